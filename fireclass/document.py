@@ -1,40 +1,68 @@
+from __future__ import annotations
+
 from abc import ABC
+import contextvars
 import dataclasses
-from typing import TypeVar, Type, Any, Optional, Iterator, Union
+import itertools
+from typing import TypeVar, Type, Any, Optional, Iterator, Dict, Callable, ClassVar, List, Sequence, TYPE_CHECKING
 
-from google.cloud import firestore, firestore_v1
-from google.cloud.firestore_v1.proto.write_pb2 import WriteResult
-from google.protobuf.timestamp_pb2 import Timestamp
 from typing_extensions import Literal
 
-from fireclass.values_conversion import convert_value_to_firestore, convert_value_from_firestore
+from fireclass.values_conversion import (
+    convert_value_to_firestore,
+    convert_value_from_firestore,
+    _FieldMeta,
+    build_document_encoder,
+    build_document_decoder,
+)
+
+# The Firestore client's modules are slow to import and are only needed for type annotations
+if TYPE_CHECKING:
+    from google.cloud import firestore, firestore_v1
+    from google.cloud.firestore_v1.proto.write_pb2 import WriteResult
+    from google.protobuf.timestamp_pb2 import Timestamp
 
-_firestore_client: Optional[firestore.Client] = None
+# The collection of each Document subclass, for the current Document._client
+_COLLECTIONS_CACHE: Dict[type, firestore_v1.CollectionReference] = {}
 
 
 def initialize_with_firestore_client(db: firestore.Client) -> None:
-    global _firestore_client
-    _firestore_client = db
+    Document._client = db
+    _COLLECTIONS_CACHE.clear()
 
 
 def _discard_firestore_client() -> None:
     """Only to be used by the test suite.
     """
-    global _firestore_client
-    _firestore_client = None
+    Document._client = None
+    _COLLECTIONS_CACHE.clear()
 
 
-class FirestoreClientNotConfigured(Exception):
-    pass
+# The references of the documents created since _record_created_documents() was called in the current context, if it was
+_CREATED_DOCUMENT_REFS: contextvars.ContextVar[Optional[List[firestore_v1.DocumentReference]]] = contextvars.ContextVar(
+    "_CREATED_DOCUMENT_REFS", default=None
+)
 
 
-def _get_firestore_client() -> firestore.Client:
-    if _firestore_client is None:
-        raise FirestoreClientNotConfigured(
-            f"Fireclass has not been initialized with a firestore.Client;"
-            f" see {initialize_with_firestore_client.__name__}() for more details."
-        )
-    return _firestore_client
+def _record_created_documents() -> None:
+    """Only to be used by the test suite; start recording the references of the documents that get created.
+    """
+    if _CREATED_DOCUMENT_REFS.get() is not None:
+        # Restarting would lose the documents recorded so far
+        raise RuntimeError("Already recording the created documents")
+    _CREATED_DOCUMENT_REFS.set([])
+
+
+def _stop_recording_created_documents() -> List[firestore_v1.DocumentReference]:
+    """Only to be used by the test suite; return the references of all the documents created since recording started.
+    """
+    created_document_refs = _CREATED_DOCUMENT_REFS.get() or []
+    _CREATED_DOCUMENT_REFS.set(None)
+    return created_document_refs
+
+
+class FirestoreClientNotConfigured(Exception):
+    pass
 
 
 class DocumentNotFound(Exception):
@@ -51,11 +79,28 @@ class DocumentAlreadyCreatedInDatabase(Exception):
 
 FirestoreOperator = Literal["<", "<=", "==", ">=", ">", "array_contains"]
 
+# Firestore rejects batched writes that contain more operations
+_MAX_WRITES_PER_BATCH = 500
+
 
 _DocumentSubclassTypeVar = TypeVar("_DocumentSubclassTypeVar", bound="Document")
 
 
+# The introspected type of each field of each Document subclass, indexed by name; built the first time it is needed
+# This can't be done in __init_subclass__() as it runs before @dataclass has added the fields to the subclass
+_FIELD_META_CACHE: Dict[type, Dict[str, _FieldMeta]] = {}
+
+# The generated function that converts instances of each Document subclass to a Firestore dict
+_ENCODERS_CACHE: Dict[type, Callable[[Any], Dict[str, Any]]] = {}
+
+# The generated function that converts Firestore documents to instances of each Document subclass
+_DECODERS_CACHE: Dict[type, Callable[[firestore_v1.DocumentSnapshot], Any]] = {}
+
+
 class _DocumentQuery:
+    # A new query is created for every where() and limit() call
+    __slots__ = ("_document_cls", "_firestore_query")
+
     def __init__(self, document_cls: Type[_DocumentSubclassTypeVar], firestore_query: firestore_v1.Query) -> None:
         self._document_cls = document_cls
         self._firestore_query = firestore_query
@@ -68,6 +113,22 @@ class _DocumentQuery:
         for firestore_document in self._firestore_query.stream(transaction):
             yield self._document_cls._from_firestore_document(firestore_document)
 
+    def stream_batch(
+        self, chunk_size: int = 256, transaction: Optional[firestore_v1.Transaction] = None
+    ) -> Iterator[_DocumentSubclassTypeVar]:
+        """Same as stream() but the documents are pulled from Firestore and decoded in chunks of chunk_size.
+        """
+        if chunk_size < 1:
+            raise ValueError(f"The supplied chunk_size {chunk_size} is not a positive number.")
+
+        decode = self._document_cls._firestore_decoder()
+        firestore_documents = self._firestore_query.stream(transaction)
+        while True:
+            firestore_documents_chunk = list(itertools.islice(firestore_documents, chunk_size))
+            if not firestore_documents_chunk:
+                return
+            yield from [decode(firestore_document) for firestore_document in firestore_documents_chunk]
+
     def where(self, field_path: str, op_string: FirestoreOperator, value: Any) -> "_DocumentQuery":
         # This is to support compound queries
         # https://firebase.google.com/docs/firestore/query-data/queries#compound_queries
@@ -77,47 +138,85 @@ class _DocumentQuery:
 
 @dataclasses.dataclass
 class Document(ABC):
+    # Only store the ID in a slot; subclasses can be fully slotted with @dataclass(slots=True) on Python 3.10+
+    # The slot is only set when the document was saved to the DB or retrieved from the DB
+    __slots__ = ("_id",)
+
+    # The client shared by all Document subclasses; set via initialize_with_firestore_client()
+    # Not annotated as a firestore.Client, which is only imported for type checking, so that get_type_hints() works on
+    # the Document subclasses
+    _client: ClassVar[Any] = None
+
     def __post_init__(self) -> None:
-        self._id: Optional[str] = None  # Set when the document was saved to the DB or retrieved from the DB
+        # Nothing to do, but subclasses with their own __post_init__() are expected to call super().__post_init__()
+        pass
 
     @property
     def id(self) -> Optional[str]:
-        return self._id
+        return getattr(self, "_id", None)
 
     def create(self, document_id: Optional[str] = None) -> WriteResult:
         if self.id is not None:
             raise DocumentAlreadyCreatedInDatabase()
         document_ref = self._collection().document(document_id)
-        encoded_dict = convert_value_to_firestore(dataclasses.asdict(self))
+        encoded_dict = self._to_firestore_dict()
         write_result = document_ref.create(encoded_dict)
         self._id = document_ref.id
+        created_document_refs = _CREATED_DOCUMENT_REFS.get()
+        if created_document_refs is not None:
+            created_document_refs.append(document_ref)
         return write_result
 
     def update(self) -> WriteResult:
         if self.id is None:
             raise DocumentNotCreatedInDatabase()
         document_ref = self._collection().document(self.id)
-        encoded_dict = convert_value_to_firestore(dataclasses.asdict(self))
+        encoded_dict = self._to_firestore_dict()
         write_result = document_ref.update(encoded_dict)
         self._id = document_ref.id
         return write_result
 
+    def _to_firestore_dict(self) -> Dict[str, Any]:
+        """Convert this document's fields to a dict that can be saved to Firestore, in a single pass.
+        """
+        return self._firestore_encoder()(self)
+
     def delete(self) -> Timestamp:
         if self.id is None:
             raise DocumentNotCreatedInDatabase()
         return self.delete_document(self.id)
 
     @classmethod
-    def _find_field(cls, field_name: str) -> dataclasses.Field:
-        corresponding_field = None
-        for defined_field in dataclasses.fields(cls):
-            if defined_field.name == field_name:
-                corresponding_field = defined_field
+    def _field_meta(cls) -> Dict[str, _FieldMeta]:
+        field_meta_by_name = _FIELD_META_CACHE.get(cls)
+        if field_meta_by_name is None:
+            field_meta_by_name = {
+                defined_field.name: _FieldMeta.from_field(defined_field) for defined_field in dataclasses.fields(cls)
+            }
+            _FIELD_META_CACHE[cls] = field_meta_by_name
+        return field_meta_by_name
 
-        if not corresponding_field:
-            raise TypeError(f"The supplied field_path '{field_name}' does not exist on '{cls.__name__}'")
+    @classmethod
+    def _firestore_encoder(cls) -> Callable[[Any], Dict[str, Any]]:
+        encoder = _ENCODERS_CACHE.get(cls)
+        if encoder is None:
+            encoder = build_document_encoder(cls._field_meta())
+            _ENCODERS_CACHE[cls] = encoder
+        return encoder
+
+    @classmethod
+    def _find_field_meta(cls, field_name: str) -> _FieldMeta:
+        return _find_field_meta_in(cls, cls._field_meta(), field_name)
 
-        return corresponding_field
+    @classmethod
+    def _firestore_decoder(
+        cls: Type[_DocumentSubclassTypeVar]
+    ) -> Callable[[firestore_v1.DocumentSnapshot], _DocumentSubclassTypeVar]:
+        decoder = _DECODERS_CACHE.get(cls)
+        if decoder is None:
+            decoder = build_document_decoder(cls, cls._field_meta(), cls._from_firestore_dict, Document)
+            _DECODERS_CACHE[cls] = decoder
+        return decoder
 
     @classmethod
     def _from_firestore_document(
@@ -125,18 +224,45 @@ class Document(ABC):
     ) -> _DocumentSubclassTypeVar:
         """Convert a document as returned by the Firestore client to the corresponding fireclass.Document instance.
         """
+        return cls._firestore_decoder()(firestore_document)
+
+    @classmethod
+    def _from_firestore_dict(
+        cls: Type[_DocumentSubclassTypeVar], firestore_dict: Dict[str, Any]
+    ) -> _DocumentSubclassTypeVar:
+        """Generic version of the decoding, for Firestore documents that do not have exactly the fields of cls.
+        """
+        field_meta_by_name = cls._field_meta()
         decoded_dict = {}
-        for field_name, value in firestore_document.to_dict().items():
-            field_description = cls._find_field(field_name)
-            decoded_dict[field_name] = convert_value_from_firestore(value, field_description)
+        for field_name, value in firestore_dict.items():
+            field_meta = _find_field_meta_in(cls, field_meta_by_name, field_name)
+            decoded_dict[field_name] = convert_value_from_firestore(value, field_meta)
+
+        return cls(**decoded_dict)  # type: ignore
 
-        document = cls(**decoded_dict)  # type: ignore
-        document._id = firestore_document.id
-        return document
+    @classmethod
+    def _get_client(cls) -> firestore.Client:
+        client = Document._client
+        if client is None:
+            raise FirestoreClientNotConfigured(
+                f"Fireclass has not been initialized with a firestore.Client;"
+                f" see {initialize_with_firestore_client.__name__}() for more details."
+            )
+        return client
+
+    @classmethod
+    def _collection_name(cls) -> str:
+        """The name of the Firestore collection where the documents of this Document subclass are stored.
+        """
+        return cls.__name__
 
     @classmethod
     def _collection(cls: Type[_DocumentSubclassTypeVar]) -> firestore_v1.CollectionReference:
-        return _get_firestore_client().collection(cls.__name__)
+        collection = _COLLECTIONS_CACHE.get(cls)
+        if collection is None:
+            collection = cls._get_client().collection(cls._collection_name())
+            _COLLECTIONS_CACHE[cls] = collection
+        return collection
 
     @classmethod
     def get_document(cls: Type[_DocumentSubclassTypeVar], document_id: str) -> _DocumentSubclassTypeVar:
@@ -145,6 +271,85 @@ class Document(ABC):
             raise DocumentNotFound()
         return cls._from_firestore_document(firestore_document)
 
+    @classmethod
+    def get_many(cls: Type[_DocumentSubclassTypeVar], document_ids: Sequence[str]) -> List[_DocumentSubclassTypeVar]:
+        """Retrieve the documents with the supplied IDs from the DB using a single request.
+
+        The documents are returned in the same order as the IDs; an ID supplied multiple times gives a separate instance
+        each time.
+        """
+        if not document_ids:
+            return []
+
+        collection = cls._collection()
+        document_refs = [collection.document(document_id) for document_id in document_ids]
+        # Firestore does not return the documents in the order of the references
+        firestore_documents_by_id = {}
+        for firestore_document in cls._get_client().get_all(document_refs):
+            if not firestore_document.exists:
+                raise DocumentNotFound()
+            firestore_documents_by_id[firestore_document.id] = firestore_document
+
+        decode = cls._firestore_decoder()
+        return [decode(firestore_documents_by_id[document_id]) for document_id in document_ids]
+
+    @classmethod
+    def bulk_create(
+        cls: Type[_DocumentSubclassTypeVar], documents: Sequence[_DocumentSubclassTypeVar]
+    ) -> List[WriteResult]:
+        """Save all the supplied documents to the DB, using one batched write per 500 documents.
+
+        Each batch is atomic, but the batches that were already committed are not rolled back if a later one fails.
+        """
+        for document in documents:
+            # All the documents get saved to the collection of cls
+            if type(document) is not cls:
+                raise TypeError(f"The supplied document '{document}' is not a '{cls.__name__}'")
+            if document.id is not None:
+                raise DocumentAlreadyCreatedInDatabase()
+
+        collection = cls._collection()
+        client = cls._get_client()
+        write_results: List[WriteResult] = []
+        for batch_start in range(0, len(documents), _MAX_WRITES_PER_BATCH):
+            batch_end = batch_start + _MAX_WRITES_PER_BATCH
+            batch_documents = documents[batch_start:batch_end]
+            batch = client.batch()
+            document_refs = []
+            for document in batch_documents:
+                document_ref = collection.document()
+                batch.create(document_ref, document._to_firestore_dict())
+                document_refs.append(document_ref)
+            write_results.extend(batch.commit())
+            created_document_refs = _CREATED_DOCUMENT_REFS.get()
+            if created_document_refs is not None:
+                created_document_refs.extend(document_refs)
+
+            for document, document_ref in zip(batch_documents, document_refs):
+                document._id = document_ref.id
+        return write_results
+
+    @classmethod
+    def truncate_collection(cls) -> int:
+        """Delete all the documents of this Document subclass from the DB, using one batched write per 500 documents.
+
+        Return the number of documents that were deleted.
+        """
+        client = cls._get_client()
+        # list_documents() only returns references, without reading the documents' fields
+        document_refs = iter(cls._collection().list_documents(page_size=_MAX_WRITES_PER_BATCH))
+        deleted_count = 0
+        while True:
+            document_refs_chunk = list(itertools.islice(document_refs, _MAX_WRITES_PER_BATCH))
+            if not document_refs_chunk:
+                return deleted_count
+
+            batch = client.batch()
+            for document_ref in document_refs_chunk:
+                batch.delete(document_ref)
+            batch.commit()
+            deleted_count += len(document_refs_chunk)
+
     @classmethod
     def delete_document(cls: Type[_DocumentSubclassTypeVar], document_id: str) -> Timestamp:
         return cls._collection().document(document_id).delete()
@@ -162,34 +367,37 @@ class Document(ABC):
         return _DocumentQuery(cls, cls._collection().where(field_path, op_string, final_value))
 
 
+def _find_field_meta_in(
+    document_cls: Type[_DocumentSubclassTypeVar], field_meta_by_name: Dict[str, _FieldMeta], field_name: str
+) -> _FieldMeta:
+    try:
+        return field_meta_by_name[field_name]
+    except KeyError:
+        raise TypeError(f"The supplied field_path '{field_name}' does not exist on '{document_cls.__name__}'")
+
+
 def _validate_and_convert_value_to_firestore(
     document_cls: Type[_DocumentSubclassTypeVar], field_path: str, value: Any
 ) -> Any:
     # TODO: Add support for .
     # Check that the field exists
-    corresponding_field = document_cls._find_field(field_path)
+    field_meta = document_cls._find_field_meta(field_path)
 
     # Check that the value has the right type
-    should_raise_type_error = False
-    if hasattr(corresponding_field.type, "__origin__") and corresponding_field.type.__origin__ == Union:
-        # Special processing for Optional fields
-        if corresponding_field.type.__args__[1] != type(None):  # noqa: E721
-            # Sanity check as this should never happen: we only support Union when used for Optional[T]
-            raise TypeError(f"Unsupported field type: {corresponding_field.name}: {corresponding_field.type}")
+    if type(value) not in field_meta.accepted_types:
+        if not field_meta.accepted_types:
+            # We only support Union when used for Optional[T]
+            raise TypeError(f"Unsupported field type: {field_meta.field.name}: {field_meta.field.type}")
 
-        if corresponding_field.type.__args__[0] != type(value) and value is not None:
-            # The value is not None and is not of the expected type
-            should_raise_type_error = True
-
-    elif corresponding_field.type != type(value):
-        should_raise_type_error = True
-
-    if should_raise_type_error:
         raise TypeError(
             f"The supplied value '{value}' has type {type(value)} but the corresponding field"
-            f" '{corresponding_field.name}' requires values of type {corresponding_field.type}."
+            f" '{field_meta.field.name}' requires values of type {field_meta.field.type}."
         )
 
+    if not field_meta.needs_encoding:
+        # The value has the field's type (or is None), which can be sent to Firestore as is
+        return value
+
     # Support enum fields too
     final_value = convert_value_to_firestore(value)
     return final_value
@@ -1,88 +1,318 @@
 import dataclasses
+import operator
 from enum import Enum
-from functools import singledispatch
-from typing import Union, Any, Optional
+from typing import Union, Any, Optional, Type, Dict, Callable, List, FrozenSet, Tuple
 
 
-@singledispatch
-def convert_value_from_firestore(field_value: Any, field_description: dataclasses.Field) -> Any:
-    """This adds support for Enum fields when retrieving a Document from Firestore.
+@dataclasses.dataclass(frozen=True)
+class _FieldMeta:
+    """The result of introspecting the type of a Document field, computed once per field.
     """
-    return field_value
+
+    field: dataclasses.Field
+    is_optional: bool
+    inner_type: Any  # T for an Optional[T] field, or the type of the field otherwise
+    is_enum: bool
+    enum_cls: Optional[Type[Enum]]
+    enum_members_by_value: Dict[Any, Enum]  # The Enum's own lookup table; empty if the field is not an Enum
+    needs_encoding: bool  # False if the field's values can be sent to Firestore as is
+    accepted_types: FrozenSet[type]  # Empty if the field's type is not supported in queries
+
+    @classmethod
+    def from_field(cls, field: dataclasses.Field) -> "_FieldMeta":
+        field_type: Any = field.type
+        is_optional = False
+        inner_type = field_type
+        accepted_types: FrozenSet[type] = frozenset([field_type])
+        if hasattr(field_type, "__origin__") and field_type.__origin__ == Union:
+            # Special processing for Optional fields; we only support Union when used for Optional[T]
+            if field_type.__args__[1] == type(None):  # noqa: E721
+                is_optional = True
+                inner_type = field_type.__args__[0]
+                accepted_types = frozenset([inner_type, type(None)])
+            else:
+                accepted_types = frozenset()
+
+        is_enum = _is_class(inner_type) and issubclass(inner_type, Enum)
+        return cls(
+            field=field,
+            is_optional=is_optional,
+            inner_type=inner_type,
+            is_enum=is_enum,
+            enum_cls=inner_type if is_enum else None,
+            enum_members_by_value=inner_type._value2member_map_ if is_enum else {},
+            needs_encoding=not _is_saved_as_is(inner_type),
+            accepted_types=accepted_types,
+        )
+
+    def to_enum(self, field_value: Union[str, int]) -> Enum:
+        try:
+            return self.enum_members_by_value[field_value]
+        except KeyError:
+            # Let the Enum handle (or reject) values that are not one of its members' values
+            return self.enum_cls(field_value)  # type: ignore
 
 
-@convert_value_from_firestore.register
-def _bool(field_value: bool, field_description: dataclasses.Field) -> bool:
-    if field_description.type in [bool, Optional[bool]]:
+def _bool(field_value: bool, field_meta: _FieldMeta) -> bool:
+    if field_meta.inner_type is bool:
         return field_value
     else:
-        raise TypeError(f"Received a value '{field_value}' for field '{field_description.name}'")
+        raise TypeError(f"Received a value '{field_value}' for field '{field_meta.field.name}'")
 
 
-@convert_value_from_firestore.register
-def _str_to_enum(field_value: str, field_description: dataclasses.Field) -> Union[str, Enum]:
+def _str_to_enum(field_value: str, field_meta: _FieldMeta) -> Union[str, Enum]:
     """If the string actually belongs to an Enum field, return an instance of that Enum.
     """
-    if field_description.type == str:
+    if field_meta.inner_type is str:
+        # We received a string value for a str or Optional[str] field
         return field_value
-    elif field_description.type == Optional[str]:
-        # We received a string value for a field that may be a string or None
-        return field_value
-    elif issubclass(field_description.type, Enum):
-        enum_sub_cls = field_description.type
-        return enum_sub_cls(field_value)
+    elif field_meta.enum_cls:
+        # We received a string value for a SomeEnum or Optional[SomeEnum] field
+        return field_meta.to_enum(field_value)
     else:
-        raise TypeError(f"Received a value '{field_value}' for field '{field_description.name}'")
+        raise TypeError(f"Received a value '{field_value}' for field '{field_meta.field.name}'")
 
 
-@convert_value_from_firestore.register
-def _int_to_enum(field_value: int, field_description: dataclasses.Field) -> Union[int, Enum]:
+def _int_to_enum(field_value: int, field_meta: _FieldMeta) -> Union[int, Enum]:
     """If the int actually belongs to an Enum field, return an instance of that Enum.
     """
-    enum_cls = None
+    if field_meta.inner_type is int:
+        # We received an int value for an int or Optional[int] field
+        return field_value
+    elif field_meta.enum_cls:
+        # We received an int value for a SomeEnum or Optional[SomeEnum] field
+        return field_meta.to_enum(field_value)
+    else:
+        raise TypeError(f"Received a value '{field_value}' for field '{field_meta.field.name}'")
+
+
+# Dispatch on the exact type of the value: bool is a subclass of int but must not be handled as one
+_FROM_FIRESTORE_CONVERTERS: Dict[type, Callable[[Any, _FieldMeta], Any]] = {
+    bool: _bool,
+    str: _str_to_enum,
+    int: _int_to_enum,
+}
 
-    if field_description.type == int:
+
+def convert_value_from_firestore(field_value: Any, field_meta: _FieldMeta) -> Any:
+    """This adds support for Enum fields when retrieving a Document from Firestore.
+    """
+    converter = _FROM_FIRESTORE_CONVERTERS.get(type(field_value))
+    if converter is None:
         return field_value
-    elif hasattr(field_description.type, "__origin__") and field_description.type.__origin__ == Union:
-        # Special processing for Optional[T] fields
-        if field_description.type.__args__ == Optional[int].__args__:  # type: ignore
-            # We received an int value for an Optional[int] field
-            return field_value
-        elif issubclass(field_description.type.__args__[0], Enum):
-            # We received an int value for an Optional[SomeEnum] field
-            enum_cls = field_description.type.__args__[0]
+    return converter(field_value, field_meta)
+
+
+# How a value gets converted when saving it to Firestore, depending on its type
+_SAVED_AS_IS = 1
+_ENUM = 2
+_DICT = 3
+_LIST = 4
+_DATACLASS = 5
 
-    elif issubclass(field_description.type, Enum):
-        # We received an int value for an Enum field
-        enum_cls = field_description.type
+_CONVERSION_KINDS_CACHE: Dict[type, int] = {}
 
-    if enum_cls:
-        # We received an int value that should be parsed as an Enum
-        return enum_cls(field_value)
 
-    raise TypeError(f"Received a value '{field_value}' for field '{field_description.name}'")
+def _conversion_kind(value_type: type) -> int:
+    conversion_kind = _CONVERSION_KINDS_CACHE.get(value_type)
+    if conversion_kind is None:
+        if issubclass(value_type, Enum):
+            conversion_kind = _ENUM
+        elif issubclass(value_type, dict):
+            conversion_kind = _DICT
+        elif issubclass(value_type, list):
+            conversion_kind = _LIST
+        elif dataclasses.is_dataclass(value_type):
+            # A dataclass nested within a Document's field; its fields get saved as a dict
+            conversion_kind = _DATACLASS
+        else:
+            conversion_kind = _SAVED_AS_IS
+        _CONVERSION_KINDS_CACHE[value_type] = conversion_kind
+    return conversion_kind
 
 
-@singledispatch
 def convert_value_to_firestore(field_value: Any) -> Any:
     """This adds support for Enum fields when saving a Document to Firestore.
+
+    Enums are also converted when they are within dicts, lists and nested dataclasses; these containers are walked
+    iteratively with an explicit stack, instead of with one recursive call per nested value.
+    """
+    conversion_kind = _conversion_kind(type(field_value))
+    if conversion_kind == _SAVED_AS_IS:
+        return field_value
+    elif conversion_kind == _ENUM:
+        return field_value.value
+
+    # Each entry is a container that still needs to be converted, and where to store the result
+    encoded_root = [field_value]
+    containers_to_encode = [(encoded_root, 0, field_value)]
+    while containers_to_encode:
+        parent, key_in_parent, container = containers_to_encode.pop()
+        container_kind = _conversion_kind(type(container))
+        # Copy the container in one go (which keeps the order of dicts) then only replace the values that need it
+        encoded_container: Any
+        if container_kind == _DICT:
+            encoded_container = dict(container)
+            items = encoded_container.items()
+        elif container_kind == _LIST:
+            encoded_container = list(container)
+            items = enumerate(encoded_container)
+        else:
+            encoded_container = {
+                nested_field.name: getattr(container, nested_field.name)
+                for nested_field in dataclasses.fields(container)
+            }
+            items = encoded_container.items()
+        parent[key_in_parent] = encoded_container
+
+        for key, value in items:
+            value_kind = _CONVERSION_KINDS_CACHE.get(type(value)) or _conversion_kind(type(value))
+            if value_kind == _ENUM:
+                encoded_container[key] = value.value
+            elif value_kind != _SAVED_AS_IS:
+                containers_to_encode.append((encoded_container, key, value))
+
+    return encoded_root[0]
+
+
+def build_document_encoder(field_meta_by_name: Dict[str, _FieldMeta]) -> Callable[[Any], Dict[str, Any]]:
+    """Generate a function that converts all the fields of a Document to a dict that can be saved to Firestore.
+
+    The conversion to apply to each field is picked here once, based on the field's declared type, instead of being
+    dispatched on the type of each value by convert_value_to_firestore(). All the fields' values are read from the
+    document with a single operator.attrgetter() call.
+    """
+    field_names = list(field_meta_by_name.keys())
+    namespace: Dict[str, Any] = {"_convert": convert_value_to_firestore}
+    body_lines: List[str] = []
+    if field_names:
+        namespace["_get_values"] = operator.attrgetter(*field_names)
+        # With a single field, attrgetter() returns the value itself instead of a tuple
+        values_vars = ", ".join(f"value{index}" for index in range(len(field_names)))
+        body_lines.append(f"    {values_vars} = _get_values(document)")
+
+    encoded_items: List[str] = []
+    for index, (field_name, field_meta) in enumerate(field_meta_by_name.items()):
+        value_var = f"value{index}"
+        type_var = f"_type{index}"
+
+        if field_meta.enum_cls:
+            namespace[type_var] = field_meta.enum_cls
+            encoded_value = f"{value_var}.value if type({value_var}) is {type_var} else _convert({value_var})"
+        elif not field_meta.needs_encoding:
+            namespace[type_var] = field_meta.inner_type
+            encoded_value = f"{value_var} if type({value_var}) is {type_var} else _convert({value_var})"
+        else:
+            # Containers and more complex types go through the generic conversion
+            encoded_value = f"_convert({value_var})"
+        encoded_items.append(f"        {field_name!r}: {encoded_value},")
+
+    source = "\n".join(["def encode(document):", *body_lines, "    return {", *encoded_items, "    }"])
+    exec(source, namespace)
+    return namespace["encode"]
+
+
+def build_document_decoder(
+    document_cls: type,
+    field_meta_by_name: Dict[str, _FieldMeta],
+    decode_dict: Callable[[Dict[str, Any]], Any],
+    base_document_cls: type,
+) -> Callable[[Any], Any]:
+    """Generate a function that converts a document as returned by the Firestore client to a document_cls instance.
+
+    The generated function decodes each field inline based on its declared type, when the Firestore document has
+    exactly the fields of document_cls; it falls back to decode_dict() for any other document.
+
+    When document_cls' __init__() would only assign the fields, the instance is created without calling __init__()
+    and the decoded values are directly assigned to it, instead of going through a dict of keyword arguments.
     """
-    return field_value
+    namespace: Dict[str, Any] = {
+        "_cls": document_cls,
+        "_new": object.__new__,
+        "_convert": convert_value_from_firestore,
+        "_decode_dict": decode_dict,
+        "_field_names": set(field_meta_by_name.keys()),
+        "_enum_value_types": frozenset([str, int]),
+    }
+    body_lines: List[str] = []
+    decoded_values: List[Tuple[str, str]] = []
+    for index, (field_name, field_meta) in enumerate(field_meta_by_name.items()):
+        value_var = f"value{index}"
+        meta_var = f"_meta{index}"
+        namespace[meta_var] = field_meta
+        body_lines.append(f"        {value_var} = data[{field_name!r}]")
+
+        if field_meta.enum_cls:
+            members_var = f"_members{index}"
+            namespace[members_var] = field_meta.enum_members_by_value
+            decoded_value = (
+                f"{members_var}[{value_var}]"
+                f" if type({value_var}) in _enum_value_types and {value_var} in {members_var}"
+                f" else _convert({value_var}, {meta_var})"
+            )
+        elif _is_class(field_meta.inner_type):
+            type_var = f"_type{index}"
+            namespace[type_var] = field_meta.inner_type
+            decoded_value = f"{value_var} if type({value_var}) is {type_var} else _convert({value_var}, {meta_var})"
+        else:
+            decoded_value = f"_convert({value_var}, {meta_var})"
+        decoded_values.append((field_name, decoded_value))
+
+    if not _has_custom_init(document_cls, base_document_cls):
+        construction_lines = ["        document = _new(_cls)"]
+        construction_lines.extend(f"        document.{name} = {value}" for name, value in decoded_values)
+    else:
+        construction_lines = ["        document = _cls("]
+        construction_lines.extend(f"            {name}={value}," for name, value in decoded_values)
+        construction_lines.append("        )")
 
+    source = "\n".join(
+        [
+            "def decode(firestore_document):",
+            "    data = firestore_document.to_dict()",
+            "    if data.keys() != _field_names:",
+            "        # Some fields are missing or unknown; let the generic decoding handle it",
+            "        document = _decode_dict(data)",
+            "    else:",
+            *body_lines,
+            *construction_lines,
+            "    document._id = firestore_document.id",
+            "    return document",
+        ]
+    )
+    exec(source, namespace)
+    return namespace["decode"]
 
-@convert_value_to_firestore.register
-def _dict_to(field_value: dict) -> dict:
-    encoded_value = {}
-    for key, value in field_value.items():
-        encoded_value[key] = convert_value_to_firestore(value)
-    return encoded_value
 
+def _has_custom_init(document_cls: type, base_document_cls: type) -> bool:
+    """Whether creating an instance of the dataclass document_cls does more than assigning its fields.
+    """
+    # Either the __init__() that gets called is not the one generated by @dataclass, which leaves alone any __init__()
+    # defined in the class (even with init=True) and creates its own methods with exec(); anything that can't be
+    # identified as the generated __init__(), like a callable object, is considered custom
+    init_owner = next(owner for owner in document_cls.__mro__ if "__init__" in vars(owner))
+    init_code = getattr(vars(init_owner)["__init__"], "__code__", None)
+    init_is_generated = (
+        "__dataclass_params__" in vars(init_owner)
+        and getattr(init_owner, "__dataclass_params__").init
+        and init_code is not None
+        and init_code.co_filename == "<string>"
+    )
+    if not init_is_generated:
+        return True
+
+    # Or the generated __init__() calls a __post_init__() that does something; the one of base_document_cls does nothing
+    return getattr(document_cls, "__post_init__") is not getattr(base_document_cls, "__post_init__")
 
-@convert_value_to_firestore.register
-def _list_to(field_value: list) -> list:
-    return [convert_value_to_firestore(value) for value in field_value]
 
+def _is_saved_as_is(field_type: Any) -> bool:
+    """Whether values of this type can be sent to Firestore without conversion.
+    """
+    return _is_class(field_type) and _conversion_kind(field_type) == _SAVED_AS_IS
 
-@convert_value_to_firestore.register
-def _enum_to(field_value: Enum) -> Union[int, str]:
-    return field_value.value
+
+def _is_class(field_type: Any) -> bool:
+    """Whether the type of a field is an actual class, instead of a generic alias like List[str] or list[str].
+    """
+    # On Python 3.9 and 3.10, isinstance(list[str], type) is True but list[str] can't be used with issubclass()
+    return getattr(field_type, "__origin__", None) is None and isinstance(field_type, type)
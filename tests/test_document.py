@@ -1,13 +1,18 @@
-from dataclasses import dataclass, asdict
+import dataclasses
+import functools
+import os
+import sys
+from dataclasses import dataclass
 from datetime import datetime, timezone
-from enum import Enum
-from typing import Optional
-
-from google.cloud import firestore
+from enum import Enum, IntEnum
+from typing import Optional, List, get_type_hints
 
 from fireclass.document import (
     initialize_with_firestore_client,
     _discard_firestore_client,
+    _record_created_documents,
+    _stop_recording_created_documents,
+    _MAX_WRITES_PER_BATCH,
     FirestoreClientNotConfigured,
     DocumentNotCreatedInDatabase,
     DocumentAlreadyCreatedInDatabase,
@@ -16,46 +21,205 @@ from fireclass.document import (
 import pytest
 
 from fireclass.document import Document, DocumentNotFound
+from fireclass.values_conversion import _FieldMeta, convert_value_to_firestore, _has_custom_init
+
+
+# Computed once and shared as the default value of the models' date fields
+_DEFAULT_LOGIN_DATE = datetime.now(tz=timezone.utc)
+
 
+class _WorkerCollectionDocument(Document):
+    """Each pytest-xdist worker stores the documents in its own collections, so the concurrent test cases don't clear
+    each other's documents.
+    """
+
+    @classmethod
+    def _collection_name(cls) -> str:
+        worker_id = os.environ.get("PYTEST_XDIST_WORKER")
+        if not worker_id:
+            return cls.__name__
+        return f"{cls.__name__}_{worker_id}"
 
-class UserMembershipLevelEnum(Enum):
+
+class UserMembershipLevelEnum(IntEnum):
     NONE = 1
     INTERMEDIATE = 2
     FULL = 3
 
 
+class UserRoleEnum(Enum):
+    """Unlike an IntEnum, the members of this Enum are not equal to their value.
+    """
+
+    ADMIN = "admin"
+    GUEST = "guest"
+
+
 @dataclass
-class User(Document):
+class UserRole:
+    """A dataclass that can be nested within the fields of a Document.
+    """
+
+    role: UserRoleEnum
+    granted_by: str
+
+
+@dataclass
+class User(_WorkerCollectionDocument):
     """The model we use for our tests; it has a field of each type.
     """
 
     email_address: str = "test@test.com"
     family_members_count: int = 5
-    last_login_date: datetime = datetime.utcnow().replace(tzinfo=timezone.utc)
+    last_login_date: datetime = _DEFAULT_LOGIN_DATE
     membership: UserMembershipLevelEnum = UserMembershipLevelEnum.FULL
     is_active: bool = True
 
 
+@dataclass
+class UserWithPostInit(User):
+    """A model that does more than assigning its fields when an instance gets created.
+    """
+
+    def __post_init__(self):
+        super().__post_init__()
+        self.was_post_initialized = True
+
+
+@dataclass
+class UserWithInit(User):
+    """A model that provides its own __init__(), which @dataclass keeps.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.was_initialized_by_model = True
+
+
+@pytest.fixture(scope="session")
+def firestore_client():
+    # The Firestore client's modules are slow to import; only import them for the test cases that use the DB
+    from google.auth.credentials import AnonymousCredentials
+    from google.cloud import firestore
+
+    # The client is expensive to create so it is shared by all the tests
+    if os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        # Use a local Firestore emulator; the client connects to it because of the environment variable
+        client = firestore.Client(project="test", credentials=AnonymousCredentials())
+    else:
+        # Otherwise use a dedicated Firestore DB setup in GCP
+        client = firestore.Client.from_service_account_json("travis-ci-test-suite-service-account.json")
+
+    # The test cases only delete the documents they created; clear the documents left by an interrupted previous run
+    initialize_with_firestore_client(client)
+    for document_cls in [User, UserWithPostInit, UserWithInit, UserWithOptionalTypes, UserWithGenericTypes]:
+        _with_retry(document_cls.truncate_collection)
+    _discard_firestore_client()
+    return client
+
+
 @pytest.fixture
-def setup_firestore_db():
-    # Use a dedicated Firestore DB setup in GCP
-    db = firestore.Client.from_service_account_json("travis-ci-test-suite-service-account.json")
-    initialize_with_firestore_client(db)
+def setup_firestore_db(firestore_client):
+    initialize_with_firestore_client(firestore_client)
+    _record_created_documents()
 
     # Run the test case
     yield
 
     # Clear all the documents created by the test case
-    for user in User.stream():
-        user.delete()
+    _delete_documents(firestore_client, _stop_recording_created_documents())
+
+    # Discard the handle to the DB (but not the client itself) so that tests without this fixture run without a DB
+    _discard_firestore_client()
 
-    for user in UserWithOptionalTypes.stream():
-        user.delete()
 
-    # Discard the handle to the DB
+@pytest.fixture(scope="class")
+def setup_firestore_db_with_shared_documents(firestore_client):
+    # Seed the documents once for all the test cases of a class that only read from the DB; each test case queries for
+    # its own marker values, which are not shared by the other documents
+    initialize_with_firestore_client(firestore_client)
+    _record_created_documents()
+    users_with_intermediate_membership = [User(membership=UserMembershipLevelEnum.INTERMEDIATE) for _ in range(2)]
+    users_with_unique_email_address = [User(email_address="unique@test.com") for _ in range(2)]
+    inactive_users = [User(is_active=False) for _ in range(5)]
+    users_with_chained_email_address = [
+        User(email_address="chained@test.com", membership=UserMembershipLevelEnum.NONE) for _ in range(5)
+    ]
+    user_with_chained_email_address_and_full_membership = User(
+        email_address="chained@test.com", membership=UserMembershipLevelEnum.FULL
+    )
+    _with_retry(
+        User.bulk_create,
+        [User(email_address="12@34.com") for _ in range(5)]
+        + users_with_intermediate_membership
+        + users_with_unique_email_address
+        + inactive_users
+        + users_with_chained_email_address
+        + [user_with_chained_email_address_and_full_membership],
+        is_idempotent=False,
+    )
+
+    users_with_none_email_address = [UserWithOptionalTypes(email_address=None) for _ in range(2)]
+    _with_retry(
+        UserWithOptionalTypes.bulk_create,
+        [UserWithOptionalTypes(email_address="12@34.com") for _ in range(5)] + users_with_none_email_address,
+        is_idempotent=False,
+    )
+
+    # Run the test cases, giving them the documents they expect, indexed by document ID
+    yield {
+        "users_with_intermediate_membership": _by_id(users_with_intermediate_membership),
+        "users_with_unique_email_address": _by_id(users_with_unique_email_address),
+        "inactive_users": _by_id(inactive_users),
+        "user_with_chained_email_address_and_full_membership": _by_id(
+            [user_with_chained_email_address_and_full_membership]
+        ),
+        "users_with_none_email_address": _by_id(users_with_none_email_address),
+    }
+
+    # Clear all the documents created for the test cases
+    _delete_documents(firestore_client, _stop_recording_created_documents())
     _discard_firestore_client()
 
 
+def _with_retry(func, *args, is_idempotent=True, **kwargs):
+    # Firestore can abort writes on contention between the test cases that run concurrently; a deadline can however
+    # expire after the write was applied, so only retry on it when running the call again does not write more documents
+    from google.api_core.exceptions import Aborted, DeadlineExceeded
+    from google.api_core.retry import Retry, if_exception_type
+
+    retried_exceptions = (Aborted, DeadlineExceeded) if is_idempotent else (Aborted,)
+    retry = Retry(predicate=if_exception_type(*retried_exceptions), initial=0.05, maximum=1.0, multiplier=2.0)
+    return retry(func)(*args, **kwargs)
+
+
+def _delete_documents(db, document_refs):
+    # The references are already known so there is no need to list the collections; delete the documents with batched
+    # writes
+    for batch_start in range(0, len(document_refs), _MAX_WRITES_PER_BATCH):
+        batch_end = batch_start + _MAX_WRITES_PER_BATCH
+        batch = db.batch()
+        for document_ref in document_refs[batch_start:batch_end]:
+            batch.delete(document_ref)
+        _with_retry(batch.commit)
+
+
+def _by_id(documents):
+    return {document.id: document for document in documents}
+
+
+class _FakeFirestoreDocument:
+    """A document as returned by the Firestore client, to test the decoding of unexpected data without a DB.
+    """
+
+    def __init__(self, document_id, document_dict):
+        self.id = document_id
+        self._document_dict = document_dict
+
+    def to_dict(self):
+        return dict(self._document_dict)
+
+
 class TestDocument:
     def test_not_initialized(self):
         # Given a document
@@ -66,6 +230,54 @@ class TestDocument:
         with pytest.raises(FirestoreClientNotConfigured):
             user.create()
 
+    def test_type_hints(self):
+        # When resolving the type hints of a model, including the ones inherited from Document
+        type_hints = get_type_hints(User)
+
+        # It succeeds
+        assert str == type_hints["email_address"]
+
+    def test_convert_value_to_firestore_with_enum_in_list_in_dict(self):
+        # Given a dict containing a list that contains Enums
+        value = {"roles": [UserRoleEnum.ADMIN, "other", UserRoleEnum.GUEST], "count": 2}
+
+        # When converting it to a value that can be saved to Firestore
+        converted_value = convert_value_to_firestore(value)
+
+        # The Enums were replaced with their value
+        assert {"roles": ["admin", "other", "guest"], "count": 2} == converted_value
+
+        # And the supplied value was not modified
+        assert {"roles": [UserRoleEnum.ADMIN, "other", UserRoleEnum.GUEST], "count": 2} == value
+
+    def test_convert_value_to_firestore_with_nested_dataclass(self):
+        # Given a list of dataclasses that contain an Enum
+        value = [UserRole(role=UserRoleEnum.ADMIN, granted_by="root")]
+
+        # When converting it to a value that can be saved to Firestore
+        converted_value = convert_value_to_firestore(value)
+
+        # The dataclasses were converted to dicts, with the Enums replaced with their value
+        assert [{"role": "admin", "granted_by": "root"}] == converted_value
+
+        # And the supplied value was not modified
+        assert [UserRole(role=UserRoleEnum.ADMIN, granted_by="root")] == value
+
+    def test_convert_value_to_firestore_keeps_dict_order(self):
+        # Given a dict whose keys are not sorted, with nested containers that need to be converted
+        value = {"z": UserRoleEnum.GUEST, "a": {"y": [UserRoleEnum.ADMIN], "b": 1}, "m": "text"}
+
+        # When converting it to a value that can be saved to Firestore
+        converted_value = convert_value_to_firestore(value)
+
+        # The keys of the converted dicts are in the same order as in the supplied dicts
+        assert ["z", "a", "m"] == list(converted_value.keys())
+        assert ["y", "b"] == list(converted_value["a"].keys())
+
+        # And the supplied dict was not modified
+        assert UserRoleEnum.GUEST is value["z"]
+        assert [UserRoleEnum.ADMIN] == value["a"]["y"]
+
     def test_document_create_get_and_delete(self, setup_firestore_db):
         # Given a document
         user = User()
@@ -83,6 +295,46 @@ class TestDocument:
         with pytest.raises(DocumentNotFound):
             User.get_document(user.id)
 
+    def test_document_create_get_with_post_init(self, setup_firestore_db):
+        # Given a document whose model has a __post_init__() that calls the one of Document
+        user = UserWithPostInit()
+
+        # When saving it to the DB
+        # It succeeds
+        user.create()
+
+        # And the document can be retrieved from the DB
+        retrieved_user = UserWithPostInit.get_document(user.id)
+        assert user == retrieved_user
+
+        # And the retrieved document went through the model's __post_init__()
+        assert retrieved_user.was_post_initialized
+
+    def test_document_create_get_with_init(self, setup_firestore_db):
+        # Given a document whose model has its own __init__()
+        user = UserWithInit()
+
+        # When saving it to the DB
+        # It succeeds
+        user.create()
+
+        # And the document can be retrieved from the DB
+        retrieved_user = UserWithInit.get_document(user.id)
+        assert user == retrieved_user
+
+        # And the retrieved document went through the model's __init__()
+        assert retrieved_user.was_initialized_by_model
+
+    def test_init_that_is_not_a_function(self):
+        # Given a model whose __init__() is a callable that is not a function
+        @dataclass
+        class UserWithInitDescriptor(User):
+            __init__ = functools.partialmethod(User.__init__)
+
+        # When checking how to create its instances when decoding them
+        # It succeeds and the model's __init__() gets called
+        assert _has_custom_init(UserWithInitDescriptor, Document)
+
     def test_document_create_with_id(self, setup_firestore_db):
         # Given a document
         user = User()
@@ -106,6 +358,69 @@ class TestDocument:
         with pytest.raises(DocumentAlreadyCreatedInDatabase):
             user.create()
 
+    def test_bulk_create(self, setup_firestore_db):
+        # Given a bunch of documents
+        users = [User(email_address=f"{index}@test.com") for index in range(5)]
+
+        # When saving them all to the DB at once
+        # It succeeds
+        User.bulk_create(users)
+
+        # And the documents can be retrieved from the DB
+        retrieved_users = User.get_many([user.id for user in users])
+        assert users == retrieved_users
+
+    def test_bulk_create_but_already_created(self, setup_firestore_db):
+        # Given a document already saved to the DB
+        user = User()
+        user.create()
+
+        # When trying to create it again along with other documents
+        # It fails
+        with pytest.raises(DocumentAlreadyCreatedInDatabase):
+            User.bulk_create([User(), user])
+
+    def test_bulk_create_with_wrong_document_type(self, setup_firestore_db):
+        # When trying to save a document to the collection of another model
+        # It fails
+        with pytest.raises(TypeError):
+            User.bulk_create([User(), UserWithOptionalTypes()])
+
+    def test_get_many_with_duplicate_ids(self, setup_firestore_db):
+        # Given a document in the DB
+        user = User()
+        user.create()
+
+        # When retrieving it twice in the same call
+        retrieved_users = User.get_many([user.id, user.id])
+
+        # It succeeds and each position gets its own instance
+        assert [user, user] == retrieved_users
+        assert retrieved_users[0] is not retrieved_users[1]
+
+    def test_get_many_but_not_found(self, setup_firestore_db):
+        # Given a document in the DB
+        user = User()
+        user.create()
+
+        # When retrieving it along with a document that does not exist
+        # It fails
+        with pytest.raises(DocumentNotFound):
+            User.get_many([user.id, "does_not_exist"])
+
+    def test_truncate_collection(self, setup_firestore_db):
+        # Given a bunch of documents
+        users_count = 5
+        User.bulk_create([User() for _ in range(users_count)])
+
+        # When deleting all the documents in the collection
+        # It succeeds
+        deleted_count = User.truncate_collection()
+        assert users_count == deleted_count
+
+        # And the collection is now empty
+        assert [] == list(User.stream())
+
     def test_document_update(self, setup_firestore_db):
         # Given a document in the DB
         user = User(email_address="1@2.com", is_active=True)
@@ -150,89 +465,16 @@ class TestDocument:
     def test_get(self, setup_firestore_db):
         # Given a bunch of documents
         users_count = 5
-        saved_user_ids = set()
-        for _ in range(users_count):
-            user = User()
-            user.create()
-            saved_user_ids.add(user.id)
+        users = [User() for _ in range(users_count)]
+        User.bulk_create(users)
+        saved_user_ids = {user.id for user in users}
 
         # When retrieving every document in the collection
         # It succeeds
-        retrieved_users = [user for user in User.stream()]
+        retrieved_users = list(User.stream())
         assert 5 == len(retrieved_users)
         assert saved_user_ids == {user.id for user in retrieved_users}
 
-    def test_where_with_enum_field(self, setup_firestore_db):
-        # Given a bunch of documents
-        users_count = 5
-        for _ in range(users_count):
-            user = User(email_address="12@34.com")
-            user.create()
-
-        # And two documents with a specific field value
-        membership = UserMembershipLevelEnum.INTERMEDIATE
-        user_to_return1 = User(membership=membership)
-        user_to_return1.create()
-        user_to_return2 = User(membership=membership)
-        user_to_return2.create()
-
-        # When querying for this specific value
-        query = User.where("membership", "==", membership)
-
-        # It succeeds
-        found_users = [user for user in query.stream()]
-
-        # And the right documents are returned
-        assert 2 == len(found_users)
-        expected_users = {user_to_return1.id: user_to_return1, user_to_return2.id: user_to_return2}
-        for user in found_users:
-            assert asdict(expected_users[user.id]) == asdict(user)
-
-    def test_where_with_str_field(self, setup_firestore_db):
-        # Given a bunch of documents
-        users_count = 5
-        for _ in range(users_count):
-            user = User(email_address="12@34.com")
-            user.create()
-
-        # And two documents with a specific field value that's an Enum
-        email_address = "unique@test.com"
-        user_to_return1 = User(email_address=email_address)
-        user_to_return1.create()
-        user_to_return2 = User(email_address=email_address)
-        user_to_return2.create()
-
-        # When querying for this specific value
-        query = User.where("email_address", "==", email_address)
-
-        # It succeeds
-        found_users = [user for user in query.stream()]
-
-        # And the right documents are returned
-        assert 2 == len(found_users)
-        expected_users = {user_to_return1.id: user_to_return1, user_to_return2.id: user_to_return2}
-        for user in found_users:
-            assert asdict(expected_users[user.id]) == asdict(user)
-
-    def test_where_with_limit(self, setup_firestore_db):
-        # Given a bunch of documents
-        users_count = 5
-        for _ in range(users_count):
-            user = User(is_active=False)
-            user.create()
-
-        # When querying for a specific value
-        query = User.where("is_active", "==", False)
-
-        # With a limit of 2 documents
-        query = query.limit(2)
-
-        # It succeeds
-        found_users = [user for user in query.stream()]
-
-        # And the right number of documents is returned
-        assert 2 == len(found_users)
-
     def test_where_with_wrong_field_name(self, setup_firestore_db):
         # When querying for a non-existent field
         # It fails
@@ -245,33 +487,24 @@ class TestDocument:
         with pytest.raises(TypeError):
             User.where("is_active", "==", "not a bool").stream()
 
-    def test_multiple_where_chained(self, setup_firestore_db):
-        # Given a bunch of users that all have the same address and membership
-        email_address = "unique@test.com"
-        for _ in range(5):
-            user = User(email_address=email_address, membership=UserMembershipLevelEnum.NONE)
-            user.create()
-
-        # And one user with the same email but a different membership
-        user_to_return = User(email_address=email_address, membership=UserMembershipLevelEnum.FULL)
-        user_to_return.create()
-
-        # When using a compound query (ie. multiple where()) to fetch that one user
-        query = User.where("email_address", "==", email_address).where("membership", "==", UserMembershipLevelEnum.FULL)
-
-        # It succeeds
-        found_users = [user for user in query.stream()]
+    def test_where_with_wrong_operator(self, setup_firestore_db):
+        # When querying for a field by supplying an operator that Firestore does not support
+        # It fails
+        with pytest.raises(ValueError):
+            User.where("is_active", "!=", True).stream()
 
-        # And the right user was returned
-        assert 1 == len(found_users)
-        assert asdict(found_users[0]) == asdict(user_to_return)
+    def test_record_created_documents_but_already_recording(self, setup_firestore_db):
+        # When the test fixture is already recording the created documents
+        # Starting a nested recording fails instead of losing the documents recorded so far
+        with pytest.raises(RuntimeError):
+            _record_created_documents()
 
 
 @dataclass
-class UserWithOptionalTypes(Document):
+class UserWithOptionalTypes(_WorkerCollectionDocument):
     email_address: Optional[str] = "test@test.com"
     family_members_count: Optional[int] = 5
-    last_login_date: Optional[datetime] = datetime.utcnow().replace(tzinfo=timezone.utc)
+    last_login_date: Optional[datetime] = _DEFAULT_LOGIN_DATE
     membership: Optional[UserMembershipLevelEnum] = UserMembershipLevelEnum.FULL
     is_active: Optional[bool] = True
 
@@ -313,27 +546,187 @@ class TestDocumentWithOptionalTypes:
         with pytest.raises(DocumentNotFound):
             UserWithOptionalTypes.get_document(user.id)
 
-    def test_where_with_none_value(self, setup_firestore_db):
-        # Given a bunch of documents
-        users_count = 5
-        for _ in range(users_count):
-            user = UserWithOptionalTypes(email_address="12@34.com")
-            user.create()
 
-        # And two documents with a specific field set to None
-        user_to_return1 = UserWithOptionalTypes(email_address=None)
-        user_to_return1.create()
-        user_to_return2 = UserWithOptionalTypes(email_address=None)
-        user_to_return2.create()
+@dataclass
+class UserWithOptionalRole(_WorkerCollectionDocument):
+    email_address: str = "test@test.com"
+    role: Optional[UserRoleEnum] = None
+
+
+class TestDocumentDecoding:
+    # The test cases decode documents as they could be stored in Firestore, without using the DB
+
+    @pytest.mark.parametrize(
+        "field_name, wrong_value",
+        [("is_active", 1), ("email_address", True), ("family_members_count", "5")],
+        ids=["int_for_bool_field", "bool_for_str_field", "str_for_int_field"],
+    )
+    def test_decode_value_with_wrong_type(self, field_name, wrong_value):
+        # Given a stored document with a value whose type does not match the field's type
+        document_dict = User()._to_firestore_dict()
+        document_dict[field_name] = wrong_value
+
+        # When decoding it
+        # It fails
+        with pytest.raises(TypeError):
+            User._from_firestore_document(_FakeFirestoreDocument("123", document_dict))
+
+    def test_decode_unknown_enum_value(self):
+        # Given a stored document with a value that is not one of the Enum's values
+        document_dict = User()._to_firestore_dict()
+        document_dict["membership"] = 42
+
+        # When decoding it
+        # It fails
+        with pytest.raises(ValueError):
+            User._from_firestore_document(_FakeFirestoreDocument("123", document_dict))
+
+    @pytest.mark.parametrize(
+        "document_dict",
+        [{"email_address": "test@test.com", "role": "admin"}, {"role": "admin"}],
+        ids=["all_fields", "missing_field"],
+    )
+    def test_decode_str_for_optional_enum_field(self, document_dict):
+        # Given a stored document with a str value for an Optional[SomeEnum] field
 
-        # When querying for the None value
-        query = UserWithOptionalTypes.where("email_address", "==", None)
+        # When decoding it
+        decoded_user = UserWithOptionalRole._from_firestore_document(_FakeFirestoreDocument("123", document_dict))
 
+        # It succeeds and the value was converted to the Enum
+        assert UserRoleEnum.ADMIN is decoded_user.role
+        assert "123" == decoded_user.id
+
+    def test_decode_with_missing_field(self):
+        # Given a stored document that does not have all the fields of the model
+        document_dict = {"email_address": "1@2.com"}
+
+        # When decoding it
+        decoded_user = User._from_firestore_document(_FakeFirestoreDocument("123", document_dict))
+
+        # It succeeds and the missing fields have their default value
+        assert User(email_address="1@2.com") == decoded_user
+        assert "123" == decoded_user.id
+
+    def test_decode_with_unknown_field(self):
+        # Given a stored document with a field that does not exist on the model
+        document_dict = User()._to_firestore_dict()
+        document_dict["unknown_field"] = "value"
+
+        # When decoding it
+        # It fails
+        with pytest.raises(TypeError):
+            User._from_firestore_document(_FakeFirestoreDocument("123", document_dict))
+
+
+@dataclass
+class UserWithGenericTypes(_WorkerCollectionDocument):
+    email_address: str = "test@test.com"
+    nicknames: List[str] = dataclasses.field(default_factory=lambda: ["test"])
+
+
+class TestDocumentWithGenericTypes:
+    def test_document_create_get_and_delete(self, setup_firestore_db):
+        # Given a document with a field whose type is a generic alias
+        user = UserWithGenericTypes(nicknames=["a", "b"])
+
+        # When saving it to the DB without providing an ID
+        # It succeeds
+        user.create()
+
+        # And the document can be retrieved from the DB
+        retrieved_user = UserWithGenericTypes.get_document(user.id)
+        assert user == retrieved_user
+
+        # And the document can be deleted from the DB
+        UserWithGenericTypes.delete_document(user.id)
+        with pytest.raises(DocumentNotFound):
+            UserWithGenericTypes.get_document(user.id)
+
+    @pytest.mark.skipif(sys.version_info < (3, 9), reason="Generic aliases of builtins require Python 3.9+")
+    def test_field_with_builtin_generic_type(self):
+        # Given a field whose type is a generic alias of a builtin, which some Python versions consider to be a class
+        builtin_generic_cls = dataclasses.make_dataclass("BuiltinGenericModel", [("nicknames", list[str])])
+        nicknames_field = dataclasses.fields(builtin_generic_cls)[0]
+
+        # When introspecting its type
         # It succeeds
-        found_users = [user for user in query.stream()]
+        field_meta = _FieldMeta.from_field(nicknames_field)
+
+        # And the values of the field get converted when saved to Firestore
+        assert not field_meta.is_enum
+        assert field_meta.needs_encoding
+
+
+class TestDocumentQueries:
+    # All the test cases only read the documents seeded by the fixture
+
+    @pytest.mark.parametrize(
+        "document_cls, field_path, value, expected_documents_key",
+        [
+            (User, "membership", UserMembershipLevelEnum.INTERMEDIATE, "users_with_intermediate_membership"),
+            (User, "email_address", "unique@test.com", "users_with_unique_email_address"),
+            (UserWithOptionalTypes, "email_address", None, "users_with_none_email_address"),
+        ],
+        ids=["enum_field", "str_field", "none_value"],
+    )
+    def test_where(
+        self, setup_firestore_db_with_shared_documents, document_cls, field_path, value, expected_documents_key
+    ):
+        # Given a bunch of documents, including two documents with a specific field value
+        expected_documents = setup_firestore_db_with_shared_documents[expected_documents_key]
+
+        # When querying for this specific value
+        query = document_cls.where(field_path, "==", value)
+
+        # It succeeds
+        found_documents = list(query.stream())
 
         # And the right documents are returned
+        assert expected_documents == _by_id(found_documents)
+
+    def test_where_with_limit(self, setup_firestore_db_with_shared_documents):
+        # Given a bunch of documents, including five documents with a specific field value
+        # When querying for this specific value
+        query = User.where("is_active", "==", False)
+
+        # With a limit of 2 documents
+        query = query.limit(2)
+
+        # It succeeds
+        found_users = list(query.stream())
+
+        # And the right number of documents is returned
         assert 2 == len(found_users)
-        expected_users = {user_to_return1.id: user_to_return1, user_to_return2.id: user_to_return2}
-        for user in found_users:
-            assert asdict(expected_users[user.id]) == asdict(user)
+
+    def test_where_with_stream_batch(self, setup_firestore_db_with_shared_documents):
+        # Given a bunch of documents, including five documents with a specific field value
+        saved_user_ids = set(setup_firestore_db_with_shared_documents["inactive_users"])
+
+        # When querying for them and retrieving the results in chunks smaller than the number of documents
+        query = User.where("is_active", "==", False)
+
+        # It succeeds
+        found_users = list(query.stream_batch(chunk_size=2))
+
+        # And all the documents are returned
+        assert saved_user_ids == {user.id for user in found_users}
+
+        # And retrieving the results in chunks that can't contain any document fails
+        with pytest.raises(ValueError):
+            list(query.stream_batch(chunk_size=0))
+
+    def test_multiple_where_chained(self, setup_firestore_db_with_shared_documents):
+        # Given a bunch of users that all have the same address and membership
+        # And one user with the same email but a different membership
+        expected_users = setup_firestore_db_with_shared_documents["user_with_chained_email_address_and_full_membership"]
+
+        # When using a compound query (ie. multiple where()) to fetch that one user
+        query = User.where("email_address", "==", "chained@test.com").where(
+            "membership", "==", UserMembershipLevelEnum.FULL
+        )
+
+        # It succeeds
+        found_users = list(query.stream())
+
+        # And the right user was returned
+        assert expected_users == _by_id(found_users)